@@ -8,8 +8,23 @@
 import torch.utils.data as data
 
 from PIL import Image
+import numpy as np
+import binascii
+import cv2
+import glob
+import hashlib
+import json
 import os
 import os.path
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 IMG_EXTENSIONS = [
     '.jpg', '.JPG', '.jpeg', '.JPEG',
@@ -17,8 +32,40 @@ IMG_EXTENSIONS = [
 ]
 
 
+_IMG_EXTENSIONS = frozenset(ext.lower() for ext in IMG_EXTENSIONS)
+
+
 def is_image_file(filename):
-    return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
+    return os.path.splitext(filename)[1].lower() in _IMG_EXTENSIONS
+
+
+def walk_files(dir):
+    # Same (root, fnames) listing as sorted(os.walk(dir)), but scandir
+    # hands back the entry type with the listing so no extra stat per file.
+    if scandir is None:
+        return [(root, fnames) for root, _, fnames in sorted(os.walk(dir))]
+    listing = []
+    stack = [dir]
+    while stack:
+        root = stack.pop()
+        try:
+            entries = list(scandir(root))
+        except OSError:
+            # os.walk silently skips directories it cannot list
+            continue
+        fnames = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    stack.append(entry.path)
+            else:
+                fnames.append(entry.name)
+        listing.append((root, fnames))
+    return sorted(listing)
 
 
 def make_dataset(dir):
@@ -26,7 +73,7 @@ def make_dataset(dir):
     imname = []
     assert os.path.isdir(dir), '%s is not a valid directory' % dir
 
-    for root, _, fnames in sorted(os.walk(dir)):
+    for root, fnames in walk_files(dir):
         for fname in fnames:
             if is_image_file(fname):
                 path = os.path.join(root, fname)
@@ -35,22 +82,166 @@ def make_dataset(dir):
     return images,imname
 
 
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
 def default_loader(path):
+    # OpenCV decodes jpeg through libjpeg-turbo, noticeably faster than PIL
+    if os.path.splitext(path)[1].lower() in JPEG_EXTENSIONS:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
     return Image.open(path).convert('RGB')
 
 
+def _decode_into(paths, alloc):
+    # decode paths into alloc(shape); None unless all are uint8 of one shape
+    images = None
+    for i, path in enumerate(paths):
+        im = np.asarray(Image.open(path))
+        if images is None:
+            if im.dtype != np.uint8:
+                return None
+            images = alloc((len(paths),) + im.shape)
+        if im.dtype != np.uint8 or im.shape != images.shape[1:]:
+            return None
+        images[i] = im
+    return images
+
+
+# a memmap file starts with a random token also stored in its meta file, so
+# a data/meta pair left mismatched by another job is detected and rebuilt
+MEMMAP_HEADER = 16
+# temp files older than this are leftovers of a killed build
+STALE_TMP_AGE = 24 * 3600
+
+
+def _open_memmap(cache_path, meta_path, paths, stats):
+    # None unless the file on disk was built from exactly these files
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta['paths'] != paths or meta['stats'] != stats:
+        return None
+    shape = tuple(meta['shape'])
+    # map the file once and check the token through that same mapping, so
+    # a concurrent rename cannot slip another file in after the check
+    raw = np.memmap(cache_path, dtype=np.uint8, mode='r')
+    if raw.size != MEMMAP_HEADER + int(np.prod(shape)):
+        return None
+    if raw[:MEMMAP_HEADER].tobytes() != meta['token'].encode('ascii'):
+        return None
+    return raw[MEMMAP_HEADER:].reshape(shape)
+
+
+def _memmap_images(paths, cache_dir):
+    key = hashlib.sha1()
+    for path in paths:
+        key.update(path if isinstance(path, bytes) else path.encode('utf-8'))
+        key.update(b'\n')
+    cache_path = os.path.join(cache_dir, 'preload-%s.dat' % key.hexdigest()[:16])
+    meta_path = cache_path + '.meta.json'
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        now = time.time()
+        for path in glob.glob(os.path.join(cache_dir, 'preload-*.tmp')):
+            if now - os.path.getmtime(path) > STALE_TMP_AGE:
+                os.remove(path)
+        stats = [[st.st_mtime, st.st_size] for st in map(os.stat, paths)]
+    except OSError:
+        return None
+    if os.path.isfile(cache_path) and os.path.isfile(meta_path):
+        try:
+            images = _open_memmap(cache_path, meta_path, paths, stats)
+        except (IOError, OSError, ValueError, KeyError):
+            images = None
+        if images is not None:
+            return images
+
+    token = binascii.hexlify(os.urandom(MEMMAP_HEADER // 2)).decode('ascii')
+    tmp_path = '%s.%s.tmp' % (cache_path, token)
+    tmp_meta_path = '%s.%s.tmp' % (meta_path, token)
+
+    def alloc(shape):
+        with open(tmp_path, 'wb') as f:
+            f.write(token.encode('ascii'))
+        return np.memmap(tmp_path, dtype=np.uint8, mode='r+',
+                         offset=MEMMAP_HEADER, shape=shape)
+
+    images = None
+    try:
+        images = _decode_into(paths, alloc)
+        if images is None:
+            return None
+        images.flush()
+        shape = images.shape
+        with open(tmp_meta_path, 'w') as f:
+            json.dump({'paths': paths, 'stats': stats, 'shape': shape,
+                       'token': token}, f)
+        # opened before the rename, so this mapping stays on our own file
+        result = np.memmap(tmp_path, dtype=np.uint8, mode='r',
+                           offset=MEMMAP_HEADER, shape=shape)
+        try:
+            os.remove(meta_path)
+        except OSError:
+            pass
+        os.rename(tmp_path, cache_path)
+        os.rename(tmp_meta_path, meta_path)
+    except (IOError, OSError):
+        return None
+    finally:
+        # release our writable mapping before removing leftover temp files
+        del images
+        for path in (tmp_path, tmp_meta_path):
+            if os.path.isfile(path):
+                os.remove(path)
+    return result
+
+
+def preload_images(paths, cache_dir=''):
+    """Decode the images at paths once into one (N, ...) uint8 array.
+
+    Meant to run in a dataset's initialize(), before the DataLoader forks
+    its workers, so the workers share the decoded pages instead of decoding
+    every file again each epoch. Returns None if the images are not all
+    uint8 with one shape; callers then decode per sample.
+
+    With cache_dir set, the array is written there as a memmap file named
+    after the path list, with a .meta.json holding the source paths and
+    their mtime/size, and later runs map it instead of decoding while
+    those still match. Both files are written under *.tmp names and
+    renamed into place; *.tmp files left by a killed build are removed
+    once they are a day old.
+    """
+    paths = list(paths)
+    if len(paths) == 0:
+        return None
+    if cache_dir:
+        return _memmap_images(paths, cache_dir)
+    return _decode_into(paths, lambda shape: np.empty(shape, dtype=np.uint8))
+
+
+def cached_image(images, index, path):
+    # the preloaded image if there is one, otherwise decode from path
+    if images is not None and index >= 0:
+        return Image.fromarray(images[index])
+    return Image.open(path)
+
+
 class ImageFolder(data.Dataset):
 
     def __init__(self, root, transform=None, return_paths=False,
                  loader=default_loader):
-        imgs = make_dataset(root)
+        imgs, imnames = make_dataset(root)
         if len(imgs) == 0:
             raise(RuntimeError("Found 0 images in: " + root + "\n"
                                "Supported image extensions are: " +
                                ",".join(IMG_EXTENSIONS)))
 
         self.root = root
-        self.imgs = imgs
+        # parallel tuples: paths and file names share the sample index
+        self.imgs = tuple(imgs)
+        self.imnames = tuple(imnames)
         self.transform = transform
         self.return_paths = return_paths
         self.loader = loader
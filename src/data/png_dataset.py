@@ -2,7 +2,7 @@ import torch
 import os.path
 from scipy import misc
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
+from data.image_folder import make_dataset, preload_images, cached_image
 from PIL import Image
 from PIL import ImageFilter
 from pdb import set_trace as st
@@ -29,6 +29,21 @@ class PngDataset(BaseDataset):
                 if fname.endswith('.png'):
                     path = os.path.join(root,fname)
                     self.imname_pos.append(fname)
+        pos = dict((fname,i) for i,fname in enumerate(self.imname_pos))
+        self.mask_index = [pos.get(fname,-1) for fname in self.imname]
+        self.ispos = [i >= 0 for i in self.mask_index]
+        self.A_paths = [os.path.join(self.A_dir,fname) for fname in self.imname]
+        self.A_paths_pos = [os.path.join(self.A_dir,fname) for fname in self.imname_pos]
+        self.B_paths_pos = [os.path.join(self.B_dir,fname) for fname in self.imname_pos]
+        #decode the masks/images once, before the loader workers are forked
+        self.masks = None
+        if self.opt.cache_masks:
+            self.masks = preload_images(self.B_paths_pos,self.opt.cache_dir)
+        index = dict((fname,i) for i,fname in enumerate(self.imname))
+        self.image_index_pos = [index.get(fname,-1) for fname in self.imname_pos]
+        self.images = None
+        if self.opt.cache_images:
+            self.images = preload_images(self.A_paths,self.opt.cache_dir)
         self.nim = len(self.imname)
 
     def __len__(self):
@@ -54,16 +69,16 @@ class PngDataset(BaseDataset):
         if random.random() < self.opt.biased_sampling:
             r_index = index % len(self.imname_pos)
             imname = self.imname_pos[r_index]
-            A_img = Image.open(os.path.join(self.A_dir,imname))
-            B_img = Image.open(os.path.join(self.B_dir,imname))
+            A_img = cached_image(self.images,self.image_index_pos[r_index],self.A_paths_pos[r_index])
+            B_img = cached_image(self.masks,r_index,self.B_paths_pos[r_index])
         else:
             
             r_index = index % len(self.imname)
             imname = self.imname[r_index]
-            A_img = Image.open(os.path.join(self.A_dir,imname))
+            A_img = cached_image(self.images,r_index,self.A_paths[r_index])
             
-            if imname in self.imname_pos:
-                B_img = Image.open(os.path.join(self.B_dir,imname))
+            if self.ispos[r_index]:
+                B_img = cached_image(self.masks,self.mask_index[r_index],self.B_paths_pos[self.mask_index[r_index]])
             else:
                 t = A_img.size
                 B_img = Image.fromarray(np.zeros((A_img.size[0],A_img.size[1])))
@@ -115,12 +130,12 @@ class PngDataset(BaseDataset):
         h_offset = random.randint(0,max(0,h-self.opt.fineSize-1))
         A_img = A_img[:, w_offset:w_offset + self.opt.fineSize, h_offset:h_offset + self.opt.fineSize] 
         B_img = B_img[:,w_offset:w_offset + self.opt.fineSize, h_offset:h_offset + self.opt.fineSize]
+        counts = float(np.count_nonzero(B_img)) / B_img.size
         A_img = torch.from_numpy(A_img).float().div(255)
         B_img = torch.from_numpy(B_img).float().div(255)
         A_img = A_img - 0.5
         A_img = A_img * 2
 
-        counts = torch.mean(B_img.view(-1,1))
         B_img = B_img - 0.5
         B_img = B_img * 2
         count_ids = 1
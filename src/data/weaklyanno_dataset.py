@@ -4,7 +4,7 @@ sys.path.insert(0, "./..")
 import os.path
 from scipy import misc
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
+from data.image_folder import make_dataset, preload_images, cached_image
 from PIL import Image
 from PIL import ImageFilter
 from pdb import set_trace as st
@@ -76,6 +76,19 @@ class WeaklyAnnoDataset(BaseDataset):
                     self.weak_only.append(X)
                     self.all.append(X)
          
+        #decode the masks/images once, before the loader workers are forked
+        self.masks = {True: None, False: None}
+        self.images = {True: None, False: None}
+        for isstrong,points in ((True,self.strong_only),(False,self.weak_only)):
+            for i,X in enumerate(points):
+                X['image_index'] = i
+            if self.opt.cache_images:
+                self.images[isstrong] = preload_images([X['im_path'] for X in points],self.opt.cache_dir)
+            pos = [X for X in points if X['ispos']]
+            for i,X in enumerate(pos):
+                X['mask_index'] = i
+            if self.opt.cache_masks:
+                self.masks[isstrong] = preload_images([X['mask_path'] for X in pos],self.opt.cache_dir)
         self.nim = len(self.all)
         self.stats()
     def stats(self):
@@ -122,9 +135,9 @@ class WeaklyAnnoDataset(BaseDataset):
         data_point = getattr(self,choosen_set)[r_index]       
         #r_index = index % len(self.all)
         #data_point = self.all[r_index]
-        A_img = Image.open(data_point['im_path'])
+        A_img = cached_image(self.images[data_point['isstrong']],data_point['image_index'],data_point['im_path'])
         if data_point['ispos']:
-            B_img = Image.open(data_point['mask_path'])
+            B_img = cached_image(self.masks[data_point['isstrong']],data_point['mask_index'],data_point['mask_path'])
         else:
             t = A_img.size
             B_img = Image.fromarray(np.zeros((A_img.size[0],A_img.size[1])))
@@ -177,12 +190,12 @@ class WeaklyAnnoDataset(BaseDataset):
         h_offset = random.randint(0,max(0,h-self.opt.fineSize-1))
         A_img = A_img[:, w_offset:w_offset + self.opt.fineSize, h_offset:h_offset + self.opt.fineSize] 
         B_img = B_img[:,w_offset:w_offset + self.opt.fineSize, h_offset:h_offset + self.opt.fineSize]
+        counts = float(np.count_nonzero(B_img)) / B_img.size
         A_img = torch.from_numpy(A_img).float().div(255)
         B_img = torch.from_numpy(B_img).float().div(255)
         A_img = A_img - 0.5
         A_img = A_img * 2
 
-        counts = torch.mean(B_img.view(-1,1))
         B_img = B_img - 0.5
         B_img = B_img * 2
         isweak = 0 if data_point['isstrong'] else 1
@@ -1,37 +1,60 @@
 import numpy as np
 import cv2
-from scipy import misc
 import os 
-from data_processing.m_im_util import sdmkdir,to_rgb3b
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from data_processing.m_im_util import sdmkdir
 from sklearn import metrics
 #import rasterio
 #from rasterio import mask, features, warp
 
 def show_heatmap_on_image(img,mask):
     mask = np.uint8(mask)
-    heatmap = cv2.applyColorMap(mask, 3)  #Jet is 2, winter is 3 8 = cool
-    heatmap = np.float32(heatmap) / 255
-    print(heatmap.shape)
-    img = np.float32(img)/255
-    cam = heatmap* 0.5+ np.float32(img)
-    return np.uint8(cam*255)
+    heatmap = cv2.applyColorMap(mask, cv2.COLORMAP_WINTER)  #Jet is 2, winter is 3 8 = cool
+    if img.dtype != np.uint8:
+        img = cv2.convertScaleAbs(img)
+    return cv2.addWeighted(heatmap,0.5,img,1.0,0)
 def draw(im,ratio): 
     font = cv2.FONT_HERSHEY_SIMPLEX 
     cv2.putText(im,'%.02f'%(ratio),(10,200), font, 3,(255,255,255),4) 
     return im 
 
 def show_plainmask_on_image(oim,mask):
-    #mask = np.float32(mask)/255
+    #stays in uint8: cv2.add saturates at 255 so no float copy / clamp pass
     mask = np.uint8(mask)
-    mask = (mask>=150).astype(np.float)
-    #mask[mask>=0.5] =1
-    im = oim.astype(np.float)
+    im = np.asarray(oim,dtype=np.uint8)
     if im.ndim ==2:
-        im = to_rgb3b(im)
-    im = im 
-    im[:,:,1] = im[:,:,1] + mask*200
-    im[im>255] = 255
-    return im.astype(np.uint8)
+        im = cv2.cvtColor(im,cv2.COLOR_GRAY2RGB)
+    #mask>=150 -> 200, else 0, in one thresholding pass
+    _,add = cv2.threshold(mask,149,200,cv2.THRESH_BINARY)
+    ch = list(cv2.split(im))
+    ch[1] = cv2.add(ch[1],add)
+    return cv2.merge(ch)
+def _imread(path,flags):
+    #cv2.imread returns None instead of raising like misc.imread did
+    im = cv2.imread(path,flags)
+    if im is None:
+        raise IOError('cannot read image: %s'%(path))
+    return im
+def _resize(im,sz):
+    #INTER_AREA when shrinking, like PIL's antialiased bilinear that
+    #misc.imresize used; INTER_LINEAR when enlarging
+    if im.shape[0] > sz or im.shape[1] > sz:
+        return cv2.resize(im,(sz,sz),interpolation=cv2.INTER_AREA)
+    return cv2.resize(im,(sz,sz),interpolation=cv2.INTER_LINEAR)
+def roc_auc(GT,mask):
+    #ROC AUC with GT==255 as positives. For uint8 scores the ROC only has
+    #256 possible thresholds, so build it from per-value counts instead
+    #of sorting every pixel as metrics.roc_curve does.
+    if mask.dtype != np.uint8:
+        fpr, tpr, thresholds = metrics.roc_curve(GT.ravel(), mask.ravel(), pos_label=255)
+        return metrics.auc(fpr, tpr)
+    pos = (GT==255)
+    tps = np.cumsum(np.bincount(mask[pos],minlength=256)[::-1])
+    fps = np.cumsum(np.bincount(mask[~pos],minlength=256)[::-1])
+    tpr = np.r_[0,tps/float(tps[-1])]
+    fpr = np.r_[0,fps/float(fps[-1])]
+    return metrics.auc(fpr, tpr)
 def visdir(imdir,maskdir,visdir,pimlist=[]):
     
     sdmkdir(visdir)    
@@ -47,12 +70,20 @@ def visdir(imdir,maskdir,visdir,pimlist=[]):
                     pathB = os.path.join(maskdir,fname)
                     imlist.append((pathA,pathB,fname))
                     imnamelist.append(fname)
-    for pathA,pathB,fname in imlist:
-        A = misc.imread(pathA)
-        B = misc.imread(pathB)
+    def process(item):
+        pathA,pathB,fname = item
+        A = _imread(pathA,cv2.IMREAD_COLOR)
+        B = _imread(pathB,cv2.IMREAD_GRAYSCALE)
         #vim = show_heatmap_on_image(A,B)
         vim = show_plainmask_on_image(A,B)
-        misc.imsave(os.path.join(visdir,fname),np.append(A,vim,axis=1))
+        cv2.imwrite(os.path.join(visdir,fname),np.append(A,vim,axis=1))
+    #cv2 releases the GIL while decoding/encoding, so threads overlap the I/O
+    pool = ThreadPool()
+    try:
+        pool.map(process,imlist)
+    finally:
+        pool.terminate()
+        pool.join()
 def visdir2(imdir,GT,maskdir,visdir,pimlist=[]):
     sdmkdir(visdir)    
     imlist=[]
@@ -68,25 +99,29 @@ def visdir2(imdir,GT,maskdir,visdir,pimlist=[]):
                     imnamelist.append(fname)
     print(imlist)
     sz = 1500 
-    count=0
-    for pathA,pathB,pathmask,fname in imlist:
-        A = misc.imread(pathA).astype(np.uint8)
-        GT = misc.imread(pathB)
-        mask = misc.imread(pathmask)
-        A = misc.imresize(A,(sz,sz))
-        GT = misc.imresize(GT,(sz,sz))
-        mask = misc.imresize(mask,(sz,sz))
-        fpr, tpr, thresholds = metrics.roc_curve(GT.ravel(), mask.ravel(), pos_label=255)
-        auc =  metrics.auc(fpr, tpr)
+    def process(item):
+        count,(pathA,pathB,pathmask,fname) = item
+        A = _imread(pathA,cv2.IMREAD_COLOR)
+        GT = _imread(pathB,cv2.IMREAD_GRAYSCALE)
+        mask = _imread(pathmask,cv2.IMREAD_GRAYSCALE)
+        A = _resize(A,sz)
+        GT = _resize(GT,sz)
+        mask = _resize(mask,sz)
+        auc = roc_auc(GT,mask)
         GTv = show_plainmask_on_image(A,GT)
         #maskv = show_plainmask_on_image(A,mask)
         maskv = show_heatmap_on_image(A,mask)
         maskv = draw(maskv,auc)
         #misc.imsave(os.path.join(visdir,fname),np.hstack((A,maskv,GTv)))#np.append(np.append(A,GTv,axis=1),maskv,axis=1))
         #misc.imsave(os.path.join(visdir,fname),maskv)
-        misc.imsave(os.path.join(visdir,str(count)+'.png'),maskv)
-        count=count+1
+        cv2.imwrite(os.path.join(visdir,str(count)+'.png'),maskv)
         #misc.imsave(os.path.join(visdir,fname),A)#np.append(np.append(A,GTv,axis=1),maskv,axis=1))
+    pool = ThreadPool()
+    try:
+        pool.map(process,list(enumerate(imlist)))
+    finally:
+        pool.terminate()
+        pool.join()
 def visAB(root,name,imlist= []):
     
     A = root + '/A/'
@@ -100,6 +135,11 @@ def visABC(root,name,imlist=[]):
     res = root + '/res/' + name +'/'
     vis = root + '/vis_all/'+name+'/'
     visdir2(A,B,res,vis,imlist)
+def _file_auc(item):
+    pathA,pathB,pathmask,fname = item
+    GT = _imread(pathB,cv2.IMREAD_GRAYSCALE)
+    mask = _imread(pathmask,cv2.IMREAD_GRAYSCALE)
+    return (fname,roc_auc(GT,mask))
 def AUC(root,name,pimlist = []):
 
     A = root + '/A/'
@@ -117,14 +157,12 @@ def AUC(root,name,pimlist = []):
                     imlist.append((pathA,pathGT,pathmask,fname))
                     imnamelist.append(fname)
 
-    AUC =[]    
-    for pathA,pathB,pathmask,fname in imlist:
-        GT = misc.imread(pathB)
-        mask = misc.imread(pathmask)
-        fpr, tpr, thresholds = metrics.roc_curve(GT.ravel(), mask.ravel(), pos_label=255)
-        auc =  metrics.auc(fpr, tpr)
-        #maskv = show_plainmask_on_image(A,mask)
-        AUC.append((fname,auc))
+    pool = Pool()
+    try:
+        AUC = pool.map(_file_auc,imlist)
+    finally:
+        pool.terminate()
+        pool.join()
 
     return AUC
 '''
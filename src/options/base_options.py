@@ -49,6 +49,9 @@ class BaseOptions():
         self.parser.add_argument('--randomSize', action='store_true', help='if specified, do not flip the images for data augmentation')
         self.parser.add_argument('--keep_ratio', action='store_true', help='if specified, do not flip the images for data augmentation')
         self.parser.add_argument('--tsize', action='store_true', help='if specified, do not flip the images for data augmentation')
+        self.parser.add_argument('--cache_masks', action='store_true', help='decode the label masks once at startup and share them with the data loading workers')
+        self.parser.add_argument('--cache_images', action='store_true', help='decode the input images once at startup and share them with the data loading workers')
+        self.parser.add_argument('--cache_dir', type=str, default='', help='if set, keep the --cache_masks/--cache_images arrays as memmap files in this directory and reuse them across runs instead of holding them in RAM; *.tmp files left by a killed build are removed after a day')
         self.parser.add_argument('--init_type', type=str, default='normal', help='network initialization [normal|xavier|kaiming|orthogonal]')
 
         self.initialized = True